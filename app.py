@@ -2,10 +2,11 @@
 import os
 import sys
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta
 from random import randint
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, send_from_directory, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DB_PATH = os.environ.get("DB_PATH", os.path.join(BASE_DIR, "app.db"))
@@ -48,8 +49,15 @@ class Trip(db.Model):
     departure_time = db.Column(db.DateTime, nullable=True)
     notes = db.Column(db.String(300), nullable=True)
     status = db.Column(db.String(30), nullable=False, default="planned")  # planned, completed
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0", index=True)  # change-feed position, see next_version()
 
 class RequestItem(db.Model):
+    # never reuse ids: archived rows keep theirs in request_history
+    __table_args__ = (
+        db.Index("ix_request_item_status_created", "status", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     house_id = db.Column(db.Integer, db.ForeignKey('house.id'), nullable=False)  # requester
     house = db.relationship('House', backref=db.backref('requests', lazy=True))
@@ -59,15 +67,41 @@ class RequestItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price_limit = db.Column(db.Float, nullable=True)
     notes = db.Column(db.String(300), nullable=True)
-    status = db.Column(db.String(30), nullable=False, default="open")  # open, claimed, fulfilled, cancelled
-    claimed_by_trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=True)
+    status = db.Column(db.String(30), nullable=False, default="open")  # open, claimed, fulfilled, cancelled, expired
+    claimed_by_trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=True, index=True)
     fulfilled_by_trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    closed_at = db.Column(db.DateTime, nullable=True)  # when it became fulfilled/cancelled/expired
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0", index=True)  # change-feed position, see next_version()
+
+class RequestHistory(db.Model):
+    # terminal requests moved out of request_item by sweep_requests(); same ids
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    house_id = db.Column(db.Integer, db.ForeignKey('house.id'), nullable=False)
+    house = db.relationship('House')
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
+    store = db.relationship('Store')
+    item_name = db.Column(db.String(200), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    price_limit = db.Column(db.Float, nullable=True)
+    notes = db.Column(db.String(300), nullable=True)
+    status = db.Column(db.String(30), nullable=False)  # fulfilled, cancelled, expired
+    claimed_by_trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=True, index=True)
+    fulfilled_by_trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=True)
+    created_at = db.Column(db.DateTime)
+    closed_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0", index=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Delivery(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    request_id = db.Column(db.Integer, db.ForeignKey('request_item.id'), nullable=False)
-    request = db.relationship('RequestItem', backref=db.backref('delivery', uselist=False))
+    # no foreign key: sweep_requests() moves fulfilled requests to request_history with the same id,
+    # so request_id points at request_item while the request is live and at request_history after
+    request_id = db.Column(db.Integer, nullable=False)
+    request = db.relationship('RequestItem', primaryjoin='foreign(Delivery.request_id) == RequestItem.id', backref=db.backref('delivery', uselist=False))
+    archived_request = db.relationship('RequestHistory', primaryjoin='foreign(Delivery.request_id) == RequestHistory.id', viewonly=True, uselist=False)
     trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=False)
     trip = db.relationship('Trip', backref=db.backref('deliveries', lazy=True))
     delivered_by_house_id = db.Column(db.Integer, db.ForeignKey('house.id'), nullable=False)
@@ -82,6 +116,11 @@ class Delivery(db.Model):
     notes = db.Column(db.String(300), nullable=True)
 
 class LedgerEntry(db.Model):
+    # per-house statement reads each side in date order; covering so balance sums skip the table
+    __table_args__ = (
+        db.Index("ix_ledger_entry_from_created", "from_house_id", "created_at", "id", "to_house_id", "amount"),
+        db.Index("ix_ledger_entry_to_created", "to_house_id", "created_at", "id", "from_house_id", "amount"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     from_house_id = db.Column(db.Integer, db.ForeignKey('house.id'), nullable=False)
     from_house = db.relationship('House', foreign_keys=[from_house_id])
@@ -93,10 +132,44 @@ class LedgerEntry(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     delivery_id = db.Column(db.Integer, db.ForeignKey('delivery.id'), nullable=True)
 
+class IdempotencyKey(db.Model):
+    # form submissions already applied; the service worker may replay queued POSTs
+    key = db.Column(db.String(64), primary_key=True)
+    endpoint = db.Column(db.String(60), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+def next_version(*models):
+    # one past the highest version in these tables, evaluated inside the INSERT/UPDATE
+    # so concurrent writers never share a number; request_history is included so
+    # archiving the newest rows can't make versions go backwards
+    from sqlalchemy import select, func
+    highest = [select(func.coalesce(func.max(m.version), 0)).scalar_subquery() for m in models]
+    return select(func.max(*highest) + 1 if len(highest) > 1 else highest[0] + 1).scalar_subquery()
+
+@event.listens_for(RequestItem, "before_insert")
+@event.listens_for(RequestItem, "before_update")
+def bump_request_version(mapper, connection, target):
+    if db.session.is_modified(target, include_collections=False):
+        target.version = next_version(RequestItem, RequestHistory)
+
+@event.listens_for(Trip, "before_insert")
+@event.listens_for(Trip, "before_update")
+def bump_trip_version(mapper, connection, target):
+    if db.session.is_modified(target, include_collections=False):
+        target.version = next_version(Trip)
+
 
 # Admin config
 app.config["ADMIN_PIN"] = os.environ.get("ADMIN_PIN", "1234")
 
+# Request lifecycle (days; 0 disables)
+app.config["REQUEST_EXPIRY_DAYS"] = int(os.environ.get("REQUEST_EXPIRY_DAYS", "30"))  # open -> expired
+app.config["REQUEST_RETENTION_DAYS"] = int(os.environ.get("REQUEST_RETENTION_DAYS", "60"))  # terminal -> history
+app.config["REQUEST_SWEEP_INTERVAL"] = int(os.environ.get("REQUEST_SWEEP_INTERVAL", "3600"))  # seconds between lazy sweeps; 0 = CLI only
+app.config["IDEMPOTENCY_KEY_DAYS"] = int(os.environ.get("IDEMPOTENCY_KEY_DAYS", "7"))  # how long offline form replays are deduped
+
+TERMINAL_STATUSES = ("fulfilled", "cancelled", "expired")
+
 def require_admin():
     if not session.get("is_admin"):
         flash("Admin access required.", "danger")
@@ -113,6 +186,7 @@ def house_in_use(house_id: int) -> bool:
     cnt = 0
     cnt += db.session.query(func.count()).select_from(Trip).filter(Trip.house_id==house_id).scalar()
     cnt += db.session.query(func.count()).select_from(RequestItem).filter(RequestItem.house_id==house_id).scalar()
+    cnt += db.session.query(func.count()).select_from(RequestHistory).filter(RequestHistory.house_id==house_id).scalar()
     cnt += db.session.query(func.count()).select_from(Delivery).filter(Delivery.delivered_by_house_id==house_id).scalar()
     cnt += db.session.query(func.count()).select_from(Delivery).filter(Delivery.delivered_to_house_id==house_id).scalar()
     cnt += db.session.query(func.count()).select_from(LedgerEntry).filter((LedgerEntry.from_house_id==house_id)|(LedgerEntry.to_house_id==house_id)).scalar()
@@ -129,6 +203,7 @@ def store_in_use(store_id: int) -> bool:
     from sqlalchemy import func
     cnt = 0
     cnt += db.session.query(func.count()).select_from(RequestItem).filter(RequestItem.store_id==store_id).scalar()
+    cnt += db.session.query(func.count()).select_from(RequestHistory).filter(RequestHistory.store_id==store_id).scalar()
     cnt += db.session.query(func.count()).select_from(Trip).filter(Trip.store_id==store_id).scalar()
     return cnt > 0
 # ---------------------------
@@ -137,6 +212,9 @@ def store_in_use(store_id: int) -> bool:
 
 def require_login():
     if not session.get("house_id"):
+        # offline replays from the service worker need a status they can't mistake for success
+        if request.headers.get("X-Offline-Replay"):
+            return "Please sign in first.", 401
         flash("Please sign in first.", "info")
         return redirect(url_for("signup"))
     return None
@@ -146,6 +224,91 @@ def current_house():
         return db.session.get(House, session["house_id"])
     return None
 
+def sweep_requests(now=None):
+    # expire stale open requests, move old terminal ones into request_history,
+    # and drop idempotency keys too old for any offline queue to replay
+    from sqlalchemy import select, insert, update, delete, literal, func
+    now = now or datetime.utcnow()
+    expired = archived = 0
+    expiry_days = app.config["REQUEST_EXPIRY_DAYS"]
+    if expiry_days > 0:
+        res = db.session.execute(
+            update(RequestItem)
+            .where(RequestItem.status=="open", RequestItem.created_at < now - timedelta(days=expiry_days))
+            .values(status="expired", closed_at=now, updated_at=now, version=next_version(RequestItem, RequestHistory))
+        )
+        expired = res.rowcount
+    retention_days = app.config["REQUEST_RETENTION_DAYS"]
+    if retention_days > 0:
+        # retention counts from the status change; rows closed before closed_at existed fall back to created_at
+        closed = func.coalesce(RequestItem.closed_at, RequestItem.created_at)
+        stale = (RequestItem.status.in_(TERMINAL_STATUSES), closed < now - timedelta(days=retention_days))
+        # archiving is a change too: bump version so synced clients see the row move
+        cols = [c.name for c in RequestItem.__table__.columns]
+        values = {"updated_at": literal(now, db.DateTime), "version": next_version(RequestItem, RequestHistory)}
+        rows = select(*[values.get(name, RequestItem.__table__.c[name]) for name in cols], literal(now, db.DateTime)).where(*stale)
+        db.session.execute(insert(RequestHistory).from_select(cols + ["archived_at"], rows))
+        res = db.session.execute(delete(RequestItem).where(*stale))
+        archived = res.rowcount
+    key_days = app.config["IDEMPOTENCY_KEY_DAYS"]
+    if key_days > 0:
+        db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < now - timedelta(days=key_days)))
+    db.session.commit()
+    return expired, archived
+
+def claim_idempotency_key():
+    # False if this form's idempotency_key was already applied; otherwise records it in the pending commit
+    from sqlalchemy.exc import IntegrityError
+    key = (request.form.get("idempotency_key") or "").strip()[:64]
+    if not key:
+        return True
+    if db.session.get(IdempotencyKey, key):
+        return False
+    db.session.add(IdempotencyKey(key=key, endpoint=request.endpoint))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+def check_form_house(endpoint):
+    # forms carry the house that opened them: an offline form replayed after another house
+    # signed in on the same device must not be applied to that house
+    form_house = request.form.get("house_id", type=int)
+    replay = request.headers.get("X-Offline-Replay")
+    if form_house == session["house_id"] or (form_house is None and not replay):
+        return None
+    if replay:
+        return "This form was filled in by another house.", 409
+    flash("This form was opened by another house. Please try again.", "warning")
+    return redirect(url_for(endpoint))
+
+_last_sweep = None
+
+@app.before_request
+def lazy_sweep_requests():
+    global _last_sweep
+    interval = app.config["REQUEST_SWEEP_INTERVAL"]
+    if interval <= 0 or request.endpoint == "static":
+        return
+    now = datetime.utcnow()
+    if _last_sweep and (now - _last_sweep).total_seconds() < interval:
+        return
+    _last_sweep = now
+    sweep_requests(now)
+
+@app.before_request
+def note_pending_flashes():
+    g.had_flashes = "_flashes" in session
+
+@app.after_request
+def no_store_flashed_pages(response):
+    # pages showing one-off flash messages must not be cached by the service worker
+    if g.get("had_flashes"):
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
 # ---------------------------
 # Routes
 # ---------------------------
@@ -160,6 +323,13 @@ def dashboard():
 def about():
     return render_template("about.html")
 
+@app.route("/sw.js")
+def service_worker():
+    # served from the root so its scope covers every page
+    response = send_from_directory(app.static_folder, "sw.js", mimetype="application/javascript")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 @app.route("/signup", methods=["GET", "POST"])
 def signup():
     houses = House.query.order_by(House.id.asc()).all()
@@ -198,10 +368,11 @@ def list_requests():
     # map for template row building
     recent_rows = []
     for d in recent_deliveries:
+        req = d.request or d.archived_request
         recent_rows.append(type("Row", (), {
             "item_name": d.item_name,
             "quantity": d.quantity,
-            "store_name": f"{d.request.store.name} ({d.request.store.village.name})",
+            "store_name": f"{req.store.name} ({req.store.village.name})",
             "to_house": d.delivered_to_house.name,
             "from_house": d.delivered_by_house.name,
             "total_price": d.total_price
@@ -220,6 +391,12 @@ def new_request():
         price_limit_raw = request.form.get("price_limit")
         price_limit = float(price_limit_raw) if price_limit_raw else None
         notes = request.form.get("notes", "").strip()
+        mismatch = check_form_house("new_request")
+        if mismatch:
+            return mismatch
+        if not claim_idempotency_key():
+            flash("Request already created.", "info")
+            return redirect(url_for("list_requests"))
         r = RequestItem(
             house_id=session["house_id"],
             store_id=store_id,
@@ -238,15 +415,19 @@ def new_request():
 def cancel_request(request_id):
     r = db.session.get(RequestItem, request_id)
     if not r:
-        flash("Not found.", "danger")
+        if db.session.get(RequestHistory, request_id):
+            flash("This request cannot be cancelled.", "warning")
+        else:
+            flash("Not found.", "danger")
         return redirect(url_for("list_requests"))
     if r.house_id != session.get("house_id"):
         flash("You can only cancel your own request.", "danger")
         return redirect(url_for("list_requests"))
-    if r.status in ["fulfilled", "cancelled"]:
+    if r.status in TERMINAL_STATUSES:
         flash("This request cannot be cancelled.", "warning")
         return redirect(url_for("list_requests"))
     r.status = "cancelled"
+    r.closed_at = datetime.utcnow()
     db.session.commit()
     flash("Request cancelled.", "success")
     return redirect(url_for("list_requests"))
@@ -304,7 +485,9 @@ def trip_detail(trip_id):
             q = q.filter(False)  # no stores
     matching_requests = q.order_by(RequestItem.created_at.asc()).all()
 
-    claimed_requests = RequestItem.query.filter(RequestItem.claimed_by_trip_id==t.id).order_by(RequestItem.created_at.asc()).all()
+    claimed_requests = RequestItem.query.filter(RequestItem.claimed_by_trip_id==t.id).all()
+    claimed_requests += RequestHistory.query.filter(RequestHistory.claimed_by_trip_id==t.id).all()
+    claimed_requests.sort(key=lambda r: r.created_at)
     return render_template("trip_detail.html", trip=t, matching_requests=matching_requests, claimed_requests=claimed_requests)
 
 @app.route("/trips/<int:trip_id>/claim", methods=["POST"])
@@ -387,6 +570,7 @@ def deliver_trip(trip_id):
             db.session.add(entry)
 
             r.status = "fulfilled"
+            r.closed_at = datetime.utcnow()
             r.fulfilled_by_trip_id = t.id
             delivered_count += 1
 
@@ -446,6 +630,80 @@ def balances():
     recent_entries = LedgerEntry.query.order_by(LedgerEntry.created_at.desc()).limit(15).all()
     return render_template("balances.html", houses=houses, matrix=matrix, recent_entries=recent_entries)
 
+STATEMENT_PAGE_SIZE = 50
+
+def house_ledger_sides(house_id, *conds):
+    # every entry involving house_id once, signed so positive = house_id owes counterparty_id
+    from sqlalchemy import select
+    out_side = select(
+        LedgerEntry.id, LedgerEntry.created_at,
+        LedgerEntry.to_house_id.label("counterparty_id"), LedgerEntry.amount.label("amount"),
+    ).where(LedgerEntry.from_house_id == house_id, *conds)
+    in_side = select(
+        LedgerEntry.id, LedgerEntry.created_at,
+        LedgerEntry.from_house_id.label("counterparty_id"), (-LedgerEntry.amount).label("amount"),
+    ).where(LedgerEntry.to_house_id == house_id, LedgerEntry.from_house_id != house_id, *conds)
+    return out_side, in_side
+
+@app.route("/houses/<int:house_id>/statement")
+def house_statement(house_id):
+    from sqlalchemy import select, union_all, tuple_, func
+    house = db.session.get(House, house_id)
+    if not house:
+        flash("House not found.", "danger")
+        return redirect(url_for("balances"))
+    houses = {h.id: h for h in House.query.all()}
+
+    conds = []
+    start_raw = request.args.get("start", "").strip()
+    end_raw = request.args.get("end", "").strip()
+    try:
+        if start_raw:
+            conds.append(LedgerEntry.created_at >= datetime.fromisoformat(start_raw))
+        if end_raw:
+            conds.append(LedgerEntry.created_at < datetime.fromisoformat(end_raw) + timedelta(days=1))
+    except ValueError:
+        flash("Invalid date range.", "danger")
+        return redirect(url_for("house_statement", house_id=house_id))
+    # keyset pagination, newest first: ?before=<entry id>
+    before = db.session.get(LedgerEntry, request.args.get("before", type=int) or 0)
+    if before:
+        conds.append(tuple_(LedgerEntry.created_at, LedgerEntry.id) < tuple_(before.created_at, before.id))
+
+    # page rows: newest first from each side's (house, created_at, id) index, merged
+    sides = [
+        side.order_by(LedgerEntry.created_at.desc(), LedgerEntry.id.desc()).limit(STATEMENT_PAGE_SIZE + 1).subquery()
+        for side in house_ledger_sides(house_id, *conds)
+    ]
+    merged = union_all(*[select(s) for s in sides]).subquery()
+    page = select(merged).order_by(merged.c.created_at.desc(), merged.c.id.desc()).limit(STATEMENT_PAGE_SIZE + 1).cte("page")
+
+    # balance with each counterparty before the oldest page row, then run the window over the page only
+    oldest = select(page.c.created_at, page.c.id).order_by(page.c.created_at, page.c.id).limit(1).scalar_subquery()
+    older = union_all(*house_ledger_sides(house_id, tuple_(LedgerEntry.created_at, LedgerEntry.id) < oldest)).subquery()
+    opening = select(older.c.counterparty_id, func.sum(older.c.amount).label("amount")).group_by(older.c.counterparty_id).subquery()
+    balance = func.coalesce(opening.c.amount, 0) + func.sum(page.c.amount).over(
+        partition_by=page.c.counterparty_id,
+        order_by=(page.c.created_at, page.c.id),
+        rows=(None, 0),
+    )
+    rows = db.session.execute(
+        select(page, LedgerEntry.entry_type, LedgerEntry.description, balance.label("balance"))
+        .select_from(page.join(LedgerEntry, LedgerEntry.id == page.c.id).outerjoin(opening, opening.c.counterparty_id == page.c.counterparty_id))
+        .order_by(page.c.created_at.desc(), page.c.id.desc())
+    ).all()
+    next_before = rows[STATEMENT_PAGE_SIZE - 1].id if len(rows) > STATEMENT_PAGE_SIZE else None
+    rows = rows[:STATEMENT_PAGE_SIZE]
+
+    everything = union_all(*house_ledger_sides(house_id)).subquery()
+    totals = db.session.execute(
+        select(everything.c.counterparty_id, func.sum(everything.c.amount)).group_by(everything.c.counterparty_id)
+    ).all()
+    return render_template(
+        "statement.html", house=house, houses=houses, rows=rows, totals=totals,
+        start=start_raw, end=end_raw, next_before=next_before,
+    )
+
 @app.route("/balances/pay", methods=["POST"])
 def record_payment():
     if not session.get("house_id"):
@@ -457,6 +715,12 @@ def record_payment():
     if amount <= 0 or from_house_id == to_house_id:
         flash("Invalid payment.", "danger")
         return redirect(url_for("balances"))
+    mismatch = check_form_house("balances")
+    if mismatch:
+        return mismatch
+    if not claim_idempotency_key():
+        flash("Payment already recorded.", "info")
+        return redirect(url_for("balances"))
     entry = LedgerEntry(
         from_house_id=from_house_id,
         to_house_id=to_house_id,
@@ -470,6 +734,110 @@ def record_payment():
     return redirect(url_for("balances"))
 
 
+# ---------------------------
+# JSON API
+# ---------------------------
+
+API_DEFAULT_LIMIT = 200
+API_MAX_LIMIT = 1000
+
+def api_row(obj):
+    # flat column values, nulls and empty strings dropped to keep payloads small
+    row = {}
+    for c in obj.__table__.columns:
+        v = getattr(obj, c.name)
+        if v is None or v == "":
+            continue
+        row[c.name] = v.isoformat(timespec="seconds") if isinstance(v, datetime) else v
+    return row
+
+def api_error(message, status=400):
+    return jsonify({"error": message}), status
+
+def api_limit():
+    limit = request.args.get("limit", API_DEFAULT_LIMIT, type=int)
+    return max(1, min(limit, API_MAX_LIMIT))
+
+def api_list(model, *filters):
+    # keyset-paginated by id: ?after=<last id>&limit=
+    after = request.args.get("after", 0, type=int)
+    limit = api_limit()
+    rows = model.query.filter(model.id > after, *filters).order_by(model.id.asc()).limit(limit + 1).all()
+    return jsonify({
+        "items": [api_row(r) for r in rows[:limit]],
+        "after": rows[limit - 1].id if len(rows) > limit else None,
+    })
+
+@app.route("/api/requests")
+def api_requests():
+    status = request.args.get("status")
+    return api_list(RequestItem, *([RequestItem.status == status] if status else []))
+
+@app.route("/api/trips")
+def api_trips():
+    status = request.args.get("status")
+    return api_list(Trip, *([Trip.status == status] if status else []))
+
+@app.route("/api/deliveries")
+def api_deliveries():
+    return api_list(Delivery)
+
+@app.route("/api/ledger")
+def api_ledger():
+    return api_list(LedgerEntry)
+
+# change feed: (models, keyset columns) in cursor order. Requests and trips change in place
+# and are keyed by (version, id); archived requests keep their id and version, so the
+# requests feed reads request_history too. Deliveries and ledger entries are append-only.
+CHANGE_FEEDS = (
+    ("requests", (RequestItem, RequestHistory), ("version", "id")),
+    ("trips", (Trip,), ("version", "id")),
+    ("deliveries", (Delivery,), ("id",)),
+    ("ledger", (LedgerEntry,), ("id",)),
+)
+
+@app.route("/api/changes")
+def api_changes():
+    # rows created or modified since the cursor; each feed is an index range scan,
+    # so the cost follows the number of changes, not the table sizes
+    from sqlalchemy import tuple_
+    width = sum(len(keys) for _, _, keys in CHANGE_FEEDS)
+    since = request.args.get("since", "").strip()
+    try:
+        cursor = [int(part) for part in since.split(".")] if since else [0] * width
+    except ValueError:
+        return api_error("Invalid cursor.")
+    if len(cursor) != width:
+        return api_error("Invalid cursor.")
+    limit = api_limit()
+
+    payload = {}
+    more = False
+    pos = 0
+    for name, models, keys in CHANGE_FEEDS:
+        after = cursor[pos:pos + len(keys)]
+        rows = []
+        for model in models:
+            cols = [getattr(model, k) for k in keys]
+            rows += (
+                model.query.filter(tuple_(*cols) > tuple_(*after))
+                .order_by(*[c.asc() for c in cols])
+                .limit(limit + 1)
+                .all()
+            )
+        rows.sort(key=lambda r: [getattr(r, k) for k in keys])
+        if len(rows) > limit:
+            more = True
+            rows = rows[:limit]
+        if rows:
+            cursor[pos:pos + len(keys)] = [getattr(rows[-1], k) for k in keys]
+        payload[name] = [api_row(r) for r in rows]
+        pos += len(keys)
+    payload["cursor"] = ".".join(str(n) for n in cursor)
+    payload["more"] = more
+    return jsonify(payload)
+
+
 # ---------------------------
 # Admin routes
 # ---------------------------
@@ -710,6 +1078,81 @@ def init_db():
         print("  ", line)
     print("Codes are also saved to house_codes.txt")
 
+def upgrade_db():
+    # bring a database from an older --initdb up to the current models, keeping its data
+    # pysqlite commits DDL on its own; drive the transaction by hand so a failed upgrade changes nothing
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.exec_driver_sql("PRAGMA legacy_alter_table=ON")  # renames don't repoint other tables' foreign keys at the _old copy
+        conn.exec_driver_sql("BEGIN")
+        try:
+            upgrade_schema(conn)
+            conn.exec_driver_sql("COMMIT")
+        except Exception:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        finally:
+            conn.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+    print("Database upgraded.")
+
+def rebuild_table(conn, model):
+    # recreate model's table from the current definition and copy its rows across
+    from sqlalchemy import inspect, text
+    name = model.__tablename__
+    cols = ", ".join(c["name"] for c in inspect(conn).get_columns(name))
+    conn.execute(text(f"ALTER TABLE {name} RENAME TO {name}_old"))
+    model.__table__.create(conn)
+    conn.execute(text(f"INSERT INTO {name} ({cols}) SELECT {cols} FROM {name}_old"))
+    conn.execute(text(f"DROP TABLE {name}_old"))
+    print(f"Rebuilt {name}.")
+
+def upgrade_schema(conn):
+    from sqlalchemy import inspect, text
+    tables = set(inspect(conn).get_table_names())
+
+    # SQLite can only change these by rebuilding the table: request_item needs AUTOINCREMENT so
+    # archived ids are never reused, and delivery.request_id must lose its foreign key to request_item
+    ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type='table' AND name='request_item'")).scalar()
+    if ddl and "AUTOINCREMENT" not in ddl.upper():
+        rebuild_table(conn, RequestItem)
+    ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type='table' AND name='delivery'")).scalar()
+    if ddl and "REFERENCES request_item" in ddl:
+        rebuild_table(conn, Delivery)
+
+    # columns added since the table was created
+    insp = inspect(conn)
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=conn.dialect)}"
+            if col.server_default is not None:
+                ddl += f" DEFAULT {col.server_default.arg}"
+            if not col.nullable:
+                ddl += " NOT NULL"
+            conn.execute(text(ddl))
+            print(f"Added {table.name}.{col.name}.")
+
+    # new tables, and indexes on the old ones
+    db.metadata.create_all(conn)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+    # backfill change-feed positions and timestamps for rows written by older code
+    conn.execute(text("UPDATE request_item SET updated_at = created_at WHERE updated_at IS NULL"))
+    conn.execute(text(
+        "UPDATE request_item SET version = id + max("
+        "(SELECT coalesce(max(version), 0) FROM request_item), "
+        "(SELECT coalesce(max(version), 0) FROM request_history)) WHERE version = 0"
+    ))
+    conn.execute(text("UPDATE trip SET version = id + (SELECT coalesce(max(version), 0) FROM trip) WHERE version = 0"))
+    # trips never recorded when they were created or changed; stamp them with the upgrade time
+    conn.execute(text("UPDATE trip SET updated_at = :now WHERE updated_at IS NULL"), {"now": datetime.utcnow()})
+
 # ---------------------------
 # CLI
 # ---------------------------
@@ -717,10 +1160,21 @@ def init_db():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--initdb", action="store_true", help="Initialize database with sample data")
+    parser.add_argument("--upgrade", action="store_true", help="Upgrade an existing database in place, keeping its data")
+    parser.add_argument("--sweep", action="store_true", help="Expire stale open requests and archive old closed ones")
     args = parser.parse_args()
     if args.initdb:
         with app.app_context():
             init_db()
         sys.exit(0)
+    if args.upgrade:
+        with app.app_context():
+            upgrade_db()
+        sys.exit(0)
+    if args.sweep:
+        with app.app_context():
+            expired, archived = sweep_requests()
+        print(f"Expired {expired} request(s), archived {archived} request(s).")
+        sys.exit(0)
     # run the dev server if invoked directly without Flask CLI
     app.run(debug=True)
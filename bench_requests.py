@@ -0,0 +1,89 @@
+"""
+Benchmark the open-request pages (dashboard, /requests, trip detail) as
+closed-request history grows, before and after sweep_requests() moves it
+into request_history.
+
+    python bench_requests.py [--sizes 0 10000 50000] [--repeat 20]
+"""
+import os
+import sys
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["REQUEST_SWEEP_INTERVAL"] = "0"
+
+from app import app, db, House, Village, Store, Trip, RequestItem, sweep_requests  # noqa: E402
+
+OPEN_REQUESTS = 50
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    houses = [House(name=f"House {i}", join_code="000000") for i in range(1, 5)]
+    village = Village(name="North Village")
+    db.session.add_all(houses + [village])
+    db.session.flush()
+    stores = [Store(name=f"Store {i}", village_id=village.id) for i in range(4)]
+    db.session.add_all(stores)
+    db.session.flush()
+    trip = Trip(house_id=houses[0].id, village_id=village.id, status="planned")
+    db.session.add(trip)
+    now = datetime.utcnow()
+    for i in range(OPEN_REQUESTS):
+        db.session.add(RequestItem(house_id=houses[i % 4].id, store_id=stores[i % 4].id,
+                                   item_name=f"open {i}", created_at=now - timedelta(hours=i)))
+    db.session.commit()
+    return houses[0].id, trip.id
+
+
+def add_history(count, house_id, store_ids):
+    if not count:
+        return
+    old = datetime.utcnow() - timedelta(days=365)
+    rows = [
+        {"house_id": house_id, "store_id": store_ids[i % len(store_ids)], "item_name": f"old {i}",
+         "quantity": 1, "status": "fulfilled" if i % 3 else "cancelled", "created_at": old, "closed_at": old}
+        for i in range(count)
+    ]
+    db.session.execute(RequestItem.__table__.insert(), rows)
+    db.session.commit()
+
+
+def time_pages(client, trip_id, repeat):
+    timings = {}
+    for name, url in (("dashboard", "/"), ("requests", "/requests"), ("trip_detail", f"/trips/{trip_id}")):
+        client.get(url)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            resp = client.get(url)
+            assert resp.status_code == 200, (url, resp.status_code)
+        timings[name] = (time.perf_counter() - start) / repeat * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 10000, 50000, 100000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'history':>8}  {'phase':<8} {'dashboard':>10} {'requests':>10} {'trip':>10}  (ms/request)")
+    with app.app_context():
+        client = app.test_client()
+        for size in args.sizes:
+            house_id, trip_id = seed()
+            add_history(size, house_id, [s.id for s in Store.query.all()])
+            for phase in ("inline", "swept"):
+                if phase == "swept":
+                    sweep_requests()
+                t = time_pages(client, trip_id, args.repeat)
+                print(f"{size:>8}  {phase:<8} {t['dashboard']:>10.2f} {t['requests']:>10.2f} {t['trip_detail']:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+// PantanoShare service worker: app shell cache, stale-while-revalidate pages,
+// and an offline queue for new-request / payment forms.
+const VERSION = "v3";
+const SHELL_CACHE = `shell-${VERSION}`;
+const PAGE_CACHE = `pages-${VERSION}`;
+// static assets only: pages show the signed-in house, so they live in PAGE_CACHE
+const SHELL = [
+  "/static/style.css",
+  "/static/icon.svg",
+  "/static/manifest.json",
+  "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+  "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
+];
+// pages served from cache while refreshed in the background
+const SWR_PAGES = [/^\/$/, /^\/requests$/, /^\/trips$/, /^\/trips\/\d+$/];
+// pages holding the queued forms: network first, cached copy offline
+const FORM_PAGES = [/^\/requests\/new$/, /^\/balances$/];
+// form posts queued while offline; the server dedupes replays by idempotency_key
+const QUEUED_POSTS = [/^\/requests\/new$/, /^\/balances\/pay$/];
+const SYNC_TAG = "replay-posts";
+
+// after any POST the next navigation goes to the network so fresh data and flashes show
+let bypassUntil = 0;
+
+self.addEventListener("install", (event) => {
+  event.waitUntil(caches.open(SHELL_CACHE).then((cache) => cache.addAll(SHELL)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener("activate", (event) => {
+  event.waitUntil(
+    caches.keys()
+      .then((keys) => Promise.all(keys.filter((k) => k !== SHELL_CACHE && k !== PAGE_CACHE).map((k) => caches.delete(k))))
+      .then(() => self.clients.claim())
+      .then(replayQueue)
+  );
+});
+
+self.addEventListener("fetch", (event) => {
+  const req = event.request;
+  const url = new URL(req.url);
+  const sameOrigin = url.origin === self.location.origin;
+
+  if (req.method === "POST") {
+    bypassUntil = Date.now() + 10000;
+    if (sameOrigin && QUEUED_POSTS.some((re) => re.test(url.pathname))) {
+      event.respondWith(postOrQueue(req));
+    }
+    return;
+  }
+  if (req.method !== "GET") return;
+
+  if (sameOrigin && url.pathname === "/logout") {
+    // queued posts stay: each names its house and is only applied while that house is signed in
+    event.waitUntil(clearPages());
+    return;
+  }
+  if (!sameOrigin || url.pathname.startsWith("/static/")) {
+    if (SHELL.includes(req.url) || SHELL.includes(url.pathname)) {
+      event.respondWith(cacheFirst(req));
+    }
+    return;
+  }
+  if (req.mode === "navigate") {
+    if (Date.now() > bypassUntil && SWR_PAGES.some((re) => re.test(url.pathname))) {
+      event.respondWith(staleWhileRevalidate(event, req));
+    } else {
+      event.respondWith(networkFirst(req));
+    }
+    event.waitUntil(replayQueue());
+  }
+});
+
+self.addEventListener("sync", (event) => {
+  if (event.tag === SYNC_TAG) event.waitUntil(replayQueue());
+});
+
+self.addEventListener("message", (event) => {
+  if (event.data && event.data.type === "replay") event.waitUntil(replayQueue());
+});
+
+// ---------------------------
+// Caching strategies
+// ---------------------------
+
+function cacheable(response) {
+  return response.ok && !response.redirected && !/no-store/.test(response.headers.get("Cache-Control") || "");
+}
+
+async function cacheFirst(req) {
+  const cached = await caches.match(req);
+  if (cached) return cached;
+  const response = await fetch(req);
+  if (response.ok) (await caches.open(SHELL_CACHE)).put(req, response.clone());
+  return response;
+}
+
+function clearPages() {
+  // every cache except the static shell may hold a personalised page
+  return caches.keys().then((keys) => Promise.all(keys.filter((k) => k !== SHELL_CACHE).map((k) => caches.delete(k))));
+}
+
+async function staleWhileRevalidate(event, req) {
+  const cache = await caches.open(PAGE_CACHE);
+  const cached = await cache.match(req);
+  const network = fetch(req).then((response) => {
+    if (cacheable(response)) cache.put(req, response.clone());
+    return response;
+  });
+  if (cached) {
+    event.waitUntil(network.catch(() => null));
+    return cached;
+  }
+  return network.catch(() => offlinePage());
+}
+
+async function networkFirst(req) {
+  try {
+    const response = await fetch(req);
+    const url = new URL(req.url);
+    if (cacheable(response) && [...SWR_PAGES, ...FORM_PAGES].some((re) => re.test(url.pathname))) {
+      (await caches.open(PAGE_CACHE)).put(req, response.clone());
+    }
+    return response;
+  } catch (err) {
+    return (await (await caches.open(PAGE_CACHE)).match(req)) || offlinePage();
+  }
+}
+
+function offlinePage() {
+  return htmlPage("You are offline", "This page is not available offline yet. Pages you have visited before still work.");
+}
+
+function htmlPage(title, message) {
+  const body = `<!doctype html><html lang="en"><head><meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1"><title>${title}</title>
+<link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet"></head>
+<body><main class="container py-4"><h1 class="h4">${title}</h1><p>${message}</p>
+<a class="btn btn-sm btn-outline-secondary" href="/">Back to Dashboard</a></main></body></html>`;
+  return new Response(body, { headers: { "Content-Type": "text/html; charset=utf-8" } });
+}
+
+// ---------------------------
+// Offline POST queue (IndexedDB)
+// ---------------------------
+
+async function postOrQueue(req) {
+  const body = await req.clone().text();
+  try {
+    return await fetch(req);
+  } catch (err) {
+    // the form's house_id partitions the queue: the server answers 409 if another house is signed in
+    const houseId = new URLSearchParams(body).get("house_id");
+    await enqueue({ url: req.url, body, houseId, queuedAt: Date.now() });
+    if (self.registration.sync) {
+      await self.registration.sync.register(SYNC_TAG).catch(() => null);
+    }
+    return htmlPage("Saved offline", "You are offline. Your form was saved on this device and will be sent automatically when the connection returns.");
+  }
+}
+
+function openQueue() {
+  return new Promise((resolve, reject) => {
+    const open = indexedDB.open("pantanoshare", 1);
+    open.onupgradeneeded = () => open.result.createObjectStore("posts", { keyPath: "id", autoIncrement: true });
+    open.onsuccess = () => resolve(open.result);
+    open.onerror = () => reject(open.error);
+  });
+}
+
+function queueOp(mode, fn) {
+  return openQueue().then((idb) => new Promise((resolve, reject) => {
+    const tx = idb.transaction("posts", mode);
+    const result = fn(tx.objectStore("posts"));
+    tx.oncomplete = () => resolve(result && result.result);
+    tx.onerror = () => reject(tx.error);
+  }));
+}
+
+function enqueue(item) {
+  return queueOp("readwrite", (store) => store.add(item));
+}
+
+let replaying = null;
+
+function replayQueue() {
+  // one replay at a time; an entry is removed only once the server confirms the write
+  if (!replaying) {
+    replaying = (async () => {
+      const items = await queueOp("readonly", (store) => store.getAll());
+      for (const item of items || []) {
+        if (item.rejected) continue;
+        let response;
+        try {
+          response = await fetch(item.url, {
+            method: "POST",
+            body: item.body,
+            headers: { "Content-Type": "application/x-www-form-urlencoded", "X-Offline-Replay": "1" },
+            credentials: "same-origin",
+          });
+        } catch (err) {
+          break; // still offline
+        }
+        if (response.ok) {
+          await queueOp("readwrite", (store) => store.delete(item.id));
+          bypassUntil = Date.now() + 10000;
+        } else if (response.status === 401) {
+          break; // signed out: keep everything until the next replay after sign-in
+        } else if (response.status === 409) {
+          continue; // queued by another house: keep it until that house signs in again
+        } else if (response.status < 500) {
+          // the server will never accept it; keep it on the device but stop retrying
+          await queueOp("readwrite", (store) => store.put({ ...item, rejected: response.status }));
+        }
+      }
+    })().finally(() => { replaying = null; });
+  }
+  return replaying;
+}